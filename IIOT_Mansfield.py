@@ -5,9 +5,6 @@
 # Libraries
 import datetime
 import streamlit as st
-
-from Plotly_Function import plot_html_handler1, plot_html_handler2, plot_html_temp_hr, plot_html_temp_hr2
-from Sql_Function import get_data_day, get_data_range, to_excel
 # ----------------------------------------------------------------------------------------------------------------------
 # Settings page
 st.set_page_config(page_title='IIOT - Mansfield',
@@ -69,70 +66,63 @@ st.header('3) Graph information')
 graph = st.checkbox('Graph', key='graph')
 
 if graph is True:
+    # Heavy modules (pandas, plotly, SQL driver) are loaded only when the user asks for the graph,
+    # python keeps them in sys.modules so the next reruns don't import them again
+    from Plotly_Function import plot_html_handler1, plot_html_handler2, plot_html_temp_hr, plot_html_temp_hr2
+    from Sql_Function import data_version, get_data_day, get_data_range, to_excel
+
+    # Room settings: graphics and columns exported to Excel
+    rooms = {'CBC 1-8': {'plots': [plot_html_handler1, plot_html_temp_hr],
+                         'columns': ['Z1_T', 'Z2_T', 'Z1_HR', 'Z2_HR', 'HA1_T_Iny', 'HA1_T_Rec', 'HA1_T_AHA',
+                                     'HA1_T_OUT', 'HA1_T_Fac', 'HA1_2_OUT_HR', 'HA1_Dmp_Vout', 'HA1_Dmp_Vrec',
+                                     'HA1_Dmp_Vfac']},
+             'CBC 10-12': {'plots': [plot_html_handler2, plot_html_temp_hr2],
+                           'columns': ['Z3_T', 'Z3_HR', 'HA2_T_Iny', 'HA2_T_Rec', 'HA2_T_AHA', 'HA2_T_OUT',
+                                       'HA1_T_Fac', 'HA1_2_OUT_HR', 'HA2_Dmp_Vout', 'HA2_Dmp_Vrec',
+                                       'HA2_Dmp_Vfac']}}
+
+    # The status row is drawn above the room header, but it is filled once the data is loaded
+    status = st.container()
+    st.header(f'Room {select_room}')
+    # Button to refresh the data: only the days of this room and period are downloaded again,
+    # the cached data of the other days and sessions is kept
+    FLAG_DOWNLOAD = st.button('Refresh graphic', key='refresh')
+
     with st.spinner('Downloading information'):
         # Search dataFrame by the day or range chosen
         if select_date == 'By day':
-            df, health_list, health_data, title = get_data_day(sel_day, select_room, FLAG_DOWNLOAD)
+            version = data_version(select_room, sel_day, sel_day, FLAG_DOWNLOAD)
+            df, health_list, health_data, title = get_data_day(sel_day, select_room, FLAG_DOWNLOAD, version)
             # Date name to use in downloading an Excel file
             AUX_ARCHIVO = sel_day
 
         elif select_date == 'By range of days':
+            version = data_version(select_room, sel_day_init, sel_day_end, FLAG_DOWNLOAD)
             df, health_list, health_data, title = get_data_range(sel_day_init, sel_day_end, select_room,
-                                                                 FLAG_DOWNLOAD)
+                                                                 FLAG_DOWNLOAD, version)
             # Date name to use in downloading an Excel file
             AUX_ARCHIVO = "from_" + str(sel_day_init) + "_until_" + str(sel_day_end)
 
-        c1, c2, c3 = st.columns(3)
-        c1.success('Success')
-        c2.metric(label='Global health data', value=f"{health_data:.2f}%")
-        # -------------------------------------------------------------------------------------------------
-        # Plot room CDI
-        if select_room == 'CBC 1-8':
-            st.header('Room CBC 1-8')
-            # Button to refresh the data
-            if st.button('Refresh graphic', key='refresh'):
-                FLAG_DOWNLOAD = True
-                get_data_day.clear()
-                get_data_range.clear()
-                st.experimental_rerun()
-
-            # Draw graph
-            with st.spinner('Drawing the graphic...'):
-                fig = plot_html_handler1(df, title)
-                st.plotly_chart(fig, use_container_width=True)
-                fig = plot_html_temp_hr(df, title)
-                st.plotly_chart(fig, use_container_width=True)
-            with st.expander("Download file"):
-                # Converting to Excel file
-                excel = to_excel(df[['Z1_T', 'Z2_T', 'Z1_HR', 'Z2_HR', 'HA1_T_Iny', 'HA1_T_Rec', 'HA1_T_AHA',
-                                     'HA1_T_OUT', 'HA1_T_Fac', 'HA1_2_OUT_HR', 'HA1_Dmp_Vout', 'HA1_Dmp_Vrec',
-                                     'HA1_Dmp_Vfac']])
-                # Button to export the data
-                st.download_button(label='📥 Download data as a *.xlsx file ', data=excel,
-                                   file_name=f'Data_room_CBC_1-8_{AUX_ARCHIVO}.xlsx')
-# ----------------------------------------------------------------------------------------------------------------------
-        # Plot room CDI
-        elif select_room == 'CBC 10-12':
-            st.header('Room CBC 10-12')
-            # Button to refresh the data
-            if st.button('Refresh graphic', key='refresh'):
-                FLAG_DOWNLOAD = True
-                get_data_day.clear()
-                get_data_range.clear()
-                st.experimental_rerun()
+    c1, c2, c3 = status.columns(3)
+    c1.success('Success')
+    c2.metric(label='Global health data', value=f"{health_data:.2f}%")
+    # -------------------------------------------------------------------------------------------------
+    # Draw graph, the figures are cached by data and title
+    with st.spinner('Drawing the graphic...'):
+        for plot in rooms[select_room]['plots']:
+            fig = plot(df, title)
+            st.plotly_chart(fig, use_container_width=True)
 
-            # Draw graph
-            with st.spinner('Drawing the graphic...'):
-                fig = plot_html_handler2(df, title)
-                st.plotly_chart(fig, use_container_width=True)
-                fig = plot_html_temp_hr2(df, title)
-                st.plotly_chart(fig, use_container_width=True)
+    with st.expander("Download file"):
+        # The Excel file is only written when the user asks for it, and it is kept in the session
+        # while the room, period and data version don't change
+        excel_key = (select_room, str(AUX_ARCHIVO), version)
+        if st.button('Prepare Excel', key='prepare_excel'):
+            with st.spinner('Writing the Excel file...'):
+                st.session_state['excel'] = (excel_key, to_excel(df[rooms[select_room]['columns']]))
 
-            with st.expander("Download file"):
-                # Converting to Excel file
-                excel = to_excel(df[['Z3_T', 'Z3_HR', 'HA2_T_Iny', 'HA2_T_Rec', 'HA2_T_AHA', 'HA2_T_OUT',
-                                     'HA1_T_Fac', 'HA1_2_OUT_HR', 'HA2_Dmp_Vout', 'HA2_Dmp_Vrec', 'HA2_Dmp_Vfac']])
-                # Button to export the data
-                st.download_button(label='📥 Download data as a *.xlsx file ', data=excel,
-                                   file_name=f'Data_room_CBC_10-12_{AUX_ARCHIVO}.xlsx')
+        if st.session_state.get('excel', (None, None))[0] == excel_key:
+            # Button to export the data
+            st.download_button(label='📥 Download data as a *.xlsx file ', data=st.session_state['excel'][1],
+                               file_name=f"Data_room_{select_room.replace(' ', '_')}_{AUX_ARCHIVO}.xlsx")
 # ----------------------------------------------------------------------------------------------------------------------
@@ -7,13 +7,20 @@ import streamlit as st
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
+from Signal_Function import to_changes
+
 
 # ----------------------------------------------------------------------------------------------------------------------
 # Function definition
 def plot_on_off(fig, df, column, legend, rgb, visibility="legendonly", second_y=True,  axis_y="y2", r=1, c=1):
+    """
+    Función para dibujar una señal de cambios lentos (dampers) como escalones rellenos. Solo se dibujan
+    las transiciones de la señal, no cada dato de 30 segundos
+    """
+    changes = to_changes(df[column])
 
-    fig.add_trace(go.Scatter(x=df.index, y=df[column],
-                             fill='tozeroy', mode="lines",
+    fig.add_trace(go.Scatter(x=changes.index, y=changes,
+                             fill='tozeroy', mode="lines", line_shape='hv',
                              fillcolor=rgb,
                              line_color='rgba(0,0,0,0)',
                              legendgroup=legend,
@@ -26,7 +33,8 @@ def plot_on_off(fig, df, column, legend, rgb, visibility="legendonly", second_y=
     return fig
 
 
-@st.cache_data(persist=False, experimental_allow_widgets=True, show_spinner=True, ttl=24 * 3600)
+@st.cache_data(persist=False, experimental_allow_widgets=True, show_spinner=True, ttl=24 * 3600,
+               max_entries=50)
 # @st.cache(persist=False, allow_output_mutation=True, suppress_st_warning=True, show_spinner=True, ttl=24 * 3600)
 def plot_html_temp_hr(df, title):
     """
@@ -74,7 +82,8 @@ def plot_html_temp_hr(df, title):
     return fig
 
 
-@st.cache_data(persist=False, experimental_allow_widgets=True, show_spinner=True, ttl=24 * 3600)
+@st.cache_data(persist=False, experimental_allow_widgets=True, show_spinner=True, ttl=24 * 3600,
+               max_entries=50)
 # @st.cache(persist=False, allow_output_mutation=True, suppress_st_warning=True, show_spinner=True, ttl=24 * 3600)
 def plot_html_handler1(df, title):
     """
@@ -140,7 +149,8 @@ def plot_html_handler1(df, title):
     return fig
 
 
-@st.cache_data(persist=False, experimental_allow_widgets=True, show_spinner=True, ttl=24 * 3600)
+@st.cache_data(persist=False, experimental_allow_widgets=True, show_spinner=True, ttl=24 * 3600,
+               max_entries=50)
 # @st.cache(persist=False, allow_output_mutation=True, suppress_st_warning=True, show_spinner=True, ttl=24 * 3600)
 def plot_html_handler2(df, title):
     """
@@ -204,7 +214,8 @@ def plot_html_handler2(df, title):
     return fig
 
 
-@st.cache_data(persist=False, experimental_allow_widgets=True, show_spinner=True, ttl=24 * 3600)
+@st.cache_data(persist=False, experimental_allow_widgets=True, show_spinner=True, ttl=24 * 3600,
+               max_entries=50)
 # @st.cache(persist=False, allow_output_mutation=True, suppress_st_warning=True, show_spinner=True, ttl=24 * 3600)
 def plot_html_temp_hr2(df, title):
     """
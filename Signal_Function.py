@@ -0,0 +1,39 @@
+# App de Mansfield with Python Streamlit
+# IIOT Climate control Mansfield
+# May-2023
+# ----------------------------------------------------------------------------------------------------------------------
+# Libraries
+import numpy as np
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Function definition
+def change_mask(values):
+    """
+    Función que marca las filas donde la señal cambia de valor. La primera y la última fila siempre se marcan
+    para que los escalones empiecen y terminen en los extremos del periodo
+    INPUT:
+        values: arreglo de numpy con la señal ordenada por tiempo
+    OUTPUT:
+        mask: arreglo booleano, True en las filas donde la señal cambia
+    """
+    mask = np.ones(len(values), dtype=bool)
+    if len(values) > 1:
+        mask[1:-1] = values[1:-1] != values[:-2]
+        if values.dtype.kind == 'f':
+            # NaN != NaN, consecutive empty values are not a change
+            empty = np.isnan(values)
+            mask[1:-1] &= ~(empty[1:-1] & empty[:-2])
+
+    return mask
+
+
+def to_changes(serie):
+    """
+    Función que reduce una señal de cambios lentos (dampers) a sus transiciones
+    INPUT:
+        serie: pandas series con índice de tiempo ordenado
+    OUTPUT:
+        serie solo con las filas donde la señal cambia, más la primera y la última
+    """
+    return serie[change_mask(serie.to_numpy())]
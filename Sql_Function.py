@@ -3,16 +3,29 @@
 # May-2023
 # ----------------------------------------------------------------------------------------------------------------------
 # Libraries
+import calendar
 import datetime
 import os
+import shutil
+import tempfile
+import threading
 
 from io import BytesIO
 import numpy as np
 import pandas as pd
 import streamlit as st
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.engine import URL
+
+from Signal_Function import change_mask
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Variables definition
+# Damper signals: they keep the same value for long periods, so they are stored and drawn only when they change
+# Date columns of the raw data, in the compacted months they are rebuilt from the time index
+DATE_COLUMNS = ['fecha', 'hora', 'minuto', 'segundo']
+DAMPER_COLUMNS = ['HA1_Dmp_Vout', 'HA1_Dmp_Vrec', 'HA1_Dmp_Vfac', 'HA2_Dmp_Vout', 'HA2_Dmp_Vrec', 'HA2_Dmp_Vfac']
+# SQLAlchemy engines by database, created only once so every download shares the same connection pool
+ENGINES = {}
+ENGINES_LOCK = threading.Lock()
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -32,16 +45,25 @@ def find_load(tipo, day, ini, database, table, redownload):
     OUTPUT:
         pd_sql: dataframe con los datos buscados o descargados
     """
-    # Setting the carpet a search
-    directory = './Data/Raw/' + day[:-3] + '/'
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    filenames = os.listdir(directory)
-
     # Empty dataframe
     pd_sql = pd.DataFrame()
 
     if tipo == "day":
+        month = day[:-3]
+        if redownload is True:
+            drop_month(month, table)
+        elif is_compacted(month, table):
+            try:
+                return load_month(month, table, ini=day, day=day)
+            except FileNotFoundError:
+                pass  # The month was dropped by a refresh of another session, the day is read from its csv
+
+        # Setting the carpet a search
+        directory = './Data/Raw/' + month + '/'
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        filenames = os.listdir(directory)
+
         # Create the name of the file to search
         filename = table + '_' + day + '.csv'
         if filename in filenames and redownload is False:
@@ -57,38 +79,289 @@ def find_load(tipo, day, ini, database, table, redownload):
         l_day_n = [int(x) for x in day.split("-")]
         day_date = datetime.date(l_day_n[0], l_day_n[1], l_day_n[2])
 
-        # Recorded the days of this period of time
+        # Recorded the period month by month, the finished months are read from the compacted store
+        frames = [pd_sql]
         while ini_date <= day_date:
-            # Setting the folder where to search
-            directory = './Data/Raw/' + str(ini_date)[:-3] + '/'
-            if not os.path.exists(directory):
-                os.makedirs(directory)
-            filenames = os.listdir(directory)
-
-            # Create the name of the file to search
-            filename = table + '_' + str(ini_date) + '.csv'
-            if filename in filenames and redownload is False:
-                aux = load_data(folder=directory, filename=filename)
-            else:
-                aux = sql_connect(tipo="day", day=str(ini_date), database=database, table=table)
-
-            pd_sql = pd.concat([pd_sql, aux])
-            # Avant a day
-            ini_date = ini_date + datetime.timedelta(days=1)
+            month = str(ini_date)[:-3]
+            end_date = min(ini_date.replace(day=calendar.monthrange(ini_date.year, ini_date.month)[1]), day_date)
+
+            if redownload is True:
+                drop_month(month, table)
+            elif not is_compacted(month, table) and month_complete(month) and month_cached(month, table):
+                compact_month(month, database, table)
+
+            aux = None
+            if redownload is False and is_compacted(month, table):
+                try:
+                    aux = load_month(month, table, ini=str(ini_date), day=str(end_date))
+                except FileNotFoundError:
+                    pass  # The month was dropped by a refresh of another session, the days are read from csv
+            if aux is None:
+                aux = load_days(ini_date, end_date, database, table, redownload)
+
+            frames.append(aux)
+            # Avant to the next month
+            ini_date = end_date + datetime.timedelta(days=1)
+
+        pd_sql = pd.concat(frames)
 
     return pd_sql
 
 
-@st.cache_data(experimental_allow_widgets=True, show_spinner=True)
+def load_days(ini_date, day_date, database, table, redownload):
+    """
+    Función que carga día por día los archivos csv del periodo, descargando los que no existan
+    INPUT:
+        ini_date: día inicial como datetime.date.
+        day_date: día final como datetime.date.
+        database: base de dato a la cual se debe conectar.
+        table: tabla a la cual se debe conectar.
+        redownload = TRUE or FALSE statement si es TRUE se descargan nuevamente todos los días.
+    OUTPUT:
+        pd_sql: dataframe con los datos de todos los días del periodo
+    """
+    frames = [pd.DataFrame()]
+    while ini_date <= day_date:
+        # Setting the folder where to search
+        directory = './Data/Raw/' + str(ini_date)[:-3] + '/'
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        filenames = os.listdir(directory)
+
+        # Create the name of the file to search
+        filename = table + '_' + str(ini_date) + '.csv'
+        if filename in filenames and redownload is False:
+            aux = load_data(folder=directory, filename=filename)
+        else:
+            aux = sql_connect(tipo="day", day=str(ini_date), database=database, table=table)
+
+        frames.append(aux)
+        # Avant a day
+        ini_date = ini_date + datetime.timedelta(days=1)
+
+    # The empty days (saved when SQL had no rows) would turn the numeric columns into object columns
+    frames = [frame for frame in frames if not frame.empty] or frames
+
+    return pd.concat(frames)
+
+
+def month_folder(month, table):
+    """
+    Carpeta del almacenamiento compactado de un mes: un archivo .npy por columna más el índice de tiempo
+    INPUT:
+        month: mes en STR ("2023-05").
+        table: tabla de la cual provienen los datos.
+    """
+    return './Data/Compact/' + month + '/' + table + '/'
+
+
+def month_complete(month):
+    """
+    Retorna True si el mes ya terminó, es decir, sus datos ya no cambian
+    INPUT:
+        month: mes en STR ("2023-05").
+    """
+    year, mon = [int(x) for x in month.split("-")]
+    last_day = datetime.date(year, mon, calendar.monthrange(year, mon)[1])
+
+    return last_day < datetime.date.today()
+
+
+def month_cached(month, table):
+    """
+    Retorna True si todos los días del mes ya están descargados en ./Data/Raw/
+    INPUT:
+        month: mes en STR ("2023-05").
+        table: tabla de la cual provienen los datos.
+    """
+    directory = './Data/Raw/' + month + '/'
+    if not os.path.exists(directory):
+        return False
+    filenames = set(os.listdir(directory))
+    year, mon = [int(x) for x in month.split("-")]
+    days = range(1, calendar.monthrange(year, mon)[1] + 1)
+
+    return all(table + '_' + str(datetime.date(year, mon, d)) + '.csv' in filenames for d in days)
+
+
+def is_compacted(month, table):
+    """
+    Retorna True si el mes ya fue compactado
+    """
+    return os.path.exists(month_folder(month, table) + '_columns.npy')
+
+
+def drop_month(month, table):
+    """
+    Borra el almacenamiento compactado del mes, se usa cuando los días del mes se descargan nuevamente.
+    La carpeta primero se renombra, así el mes deja de existir en un solo paso, y si otro proceso ya la
+    borró no pasa nada
+    """
+    folder = month_folder(month, table)
+    if not os.path.exists(folder):
+        return
+
+    trash = tempfile.mkdtemp(dir=os.path.dirname(folder[:-1]), prefix=table + '.old')
+    try:
+        os.replace(folder, trash + '/' + table)
+    except FileNotFoundError:
+        pass
+    shutil.rmtree(trash, ignore_errors=True)
+
+
+def compact_month(month, database, table, redownload=False):
+    """
+    Función que une todos los días de un mes terminado en un almacenamiento columnar: un archivo .npy por
+    columna ordenado por tiempo y un índice de tiempo (_index.npy), para poder leer rangos con memory map.
+    Las columnas de fecha no se guardan (se reconstruyen del índice) y las señales se guardan en float32,
+    el mismo tipo REAL de la tabla SQL
+    INPUT:
+        month: mes en STR ("2023-05").
+        database: base de dato a la cual se debe conectar.
+        table: tabla a la cual se debe conectar.
+        redownload = TRUE or FALSE statement si es TRUE se descargan nuevamente los días antes de compactar.
+    OUTPUT:
+        True si el mes quedó compactado (por este u otro proceso), False si el mes aún no termina
+    """
+    if not month_complete(month):
+        return False
+
+    year, mon = [int(x) for x in month.split("-")]
+    df = load_days(datetime.date(year, mon, 1), datetime.date(year, mon, calendar.monthrange(year, mon)[1]),
+                   database, table, redownload)
+
+    # Time index of every row, the same date built in organize_df
+    stamp = pd.to_datetime(df['fecha'], format='%Y/%m/%d', exact=False)
+    stamp += pd.to_timedelta(df["hora"], unit='h')
+    stamp += pd.to_timedelta(df["minuto"], unit='m')
+    stamp += pd.to_timedelta(df["segundo"], unit='s')
+    order = np.argsort(stamp.to_numpy(), kind='stable')
+
+    # Writing in a temporal folder of this writer and renaming it, a reader never sees a half written month
+    folder = month_folder(month, table)
+    os.makedirs(os.path.dirname(folder[:-1]), exist_ok=True)
+    temporal = tempfile.mkdtemp(dir=os.path.dirname(folder[:-1]), prefix=table + '.tmp') + '/'
+
+    np.save(temporal + '_index.npy', stamp.to_numpy().astype('datetime64[ns]')[order], allow_pickle=False)
+    for i, column in enumerate(df.columns):
+        if column in DATE_COLUMNS:
+            continue
+        values = pd.to_numeric(df[column]).to_numpy()[order]
+        if values.dtype.kind == 'f':
+            values = values.astype(np.float32)
+        if column in DAMPER_COLUMNS:
+            # Only the rows where the damper changes: positions in the index and the new values
+            positions = np.flatnonzero(change_mask(values))
+            np.save(temporal + str(i) + '_pos.npy', positions, allow_pickle=False)
+            values = values[positions]
+        np.save(temporal + str(i) + '.npy', values, allow_pickle=False)
+    np.save(temporal + '_columns.npy', np.array(df.columns, dtype=str), allow_pickle=False)
+
+    # If another writer finished the same month first, its folder is kept and this copy is deleted
+    try:
+        if not os.path.exists(folder):
+            os.replace(temporal, folder)
+    except OSError:
+        pass
+    shutil.rmtree(temporal, ignore_errors=True)
+
+    return True
+
+
+def load_month(month, table, ini, day):
+    """
+    Función que lee un rango de días de un mes compactado. Los archivos se abren con memory map y solo se
+    copian las filas del rango buscado en el índice de tiempo, sin leer el resto del mes
+    INPUT:
+        month: mes en STR ("2023-05").
+        table: tabla de la cual provienen los datos.
+        ini: día inicial del rango en STR ("2023-05-03").
+        day: día final del rango en STR ("2023-05-10").
+    OUTPUT:
+        df: dataframe con las mismas columnas de los archivos csv
+    """
+    folder = month_folder(month, table)
+    columns = np.load(folder + '_columns.npy')
+    index = np.load(folder + '_index.npy', mmap_mode='r')
+
+    # Position of the range inside the sorted time index
+    start, stop = np.searchsorted(index, [np.datetime64(ini, 'ns'),
+                                          np.datetime64(day, 'ns') + np.timedelta64(1, 'D')])
+
+    # Date columns rebuilt from the time index
+    stamps = np.asarray(index[start:stop])
+    days = stamps.astype('datetime64[D]')
+    seconds = (stamps - days).astype('timedelta64[s]').astype(np.int64)
+    dates = {'fecha': days.astype(str), 'hora': seconds // 3600, 'minuto': seconds // 60 % 60,
+             'segundo': seconds % 60}
+
+    data = {}
+    for i, column in enumerate(columns):
+        if not os.path.exists(folder + str(i) + '.npy'):
+            data[column] = dates[column]
+            continue
+        values = np.load(folder + str(i) + '.npy', mmap_mode='r')
+        if os.path.exists(folder + str(i) + '_pos.npy'):
+            # Column stored by changes, every row takes the value of the last change before it
+            positions = np.load(folder + str(i) + '_pos.npy')
+            values = values[np.searchsorted(positions, np.arange(start, stop), side='right') - 1]
+        else:
+            values = values[start:stop]
+        # Copy of the rows of the range, the signals come back as float64 like in the csv files
+        data[column] = values.astype(np.float64) if values.dtype.kind == 'f' else np.array(values)
+    df = pd.DataFrame(data, columns=list(columns))
+
+    return df
+
+
+@st.cache_resource
+def cache_versions():
+    """
+    Diccionario compartido por todas las sesiones con la versión de los datos de cada sala y día:
+    {(sala, "2023-05-29"): número de veces que se ha refrescado}
+    """
+    return {}
+
+
+def data_version(sql_table, sel_dia_ini, sel_dia_fin, refresh=False):
+    """
+    Función que entrega la versión de los datos de una sala en un periodo. Se usa como argumento de
+    get_data_day y get_data_range, así al refrescar solo cambian las llaves del cache de los días refrescados
+    y el resto del cache de todas las sesiones se mantiene
+    INPUT:
+        sql_table = Sala seleccionada ('CBC 1-8', 'CBC 10-12')
+        sel_dia_ini = Día inicial como datetime.date
+        sel_dia_fin = Día final como datetime.date
+        refresh = TRUE or FALSE statement si es TRUE se aumenta la versión de los días del periodo
+    OUTPUT:
+        version = Número | suma de las versiones de los días del periodo
+    """
+    versions = cache_versions()
+    version = 0
+    while sel_dia_ini <= sel_dia_fin:
+        key = (sql_table, str(sel_dia_ini))
+        if refresh is True:
+            versions[key] = versions.get(key, 0) + 1
+        version += versions.get(key, 0)
+
+        # Avant a day
+        sel_dia_ini = sel_dia_ini + datetime.timedelta(days=1)
+
+    return version
+
+
+@st.cache_data(experimental_allow_widgets=True, show_spinner=True, ttl=24 * 3600, max_entries=50)
 # @st.experimental_memo(suppress_st_warning=True, show_spinner=True)
-def get_data_day(sel_dia="2023-01-01", sql_table="Mansfield_climati_cbc", flag_download=False):
+def get_data_day(sel_dia="2023-01-01", sql_table="Mansfield_climati_cbc", _flag_download=False, version=0):
     """
     Programa que permite conectar con una base de dato del servidor y devuelve la base de dato
     como un pandas dataframe
     INPUT:
         sel_dia = Día inicial EN STR
         sql_table = Selección de la tabla SQL a la que se conectara
-        redownload = Debe descargarse la data o buscar dentro de los archivos previamente descargados.
+        _flag_download = Debe descargarse la data o buscar dentro de los archivos previamente descargados.
+        No hace parte de la llave del cache.
+        version = Versión de los datos del día entregada por data_version, cambia cuando se refresca el día.
     OUTPUT:
         df = pandas dataframe traído de la base de dato SQL
         health_list = lista con el dato de salud por día
@@ -99,7 +372,7 @@ def get_data_day(sel_dia="2023-01-01", sql_table="Mansfield_climati_cbc", flag_d
     # Connection BD
     if sql_table in ['CBC 1-8', 'CBC 10-12']:
         df = find_load(tipo='day', day=str(sel_dia), ini=None, database='Mansfield_climati_cbc',
-                       table='Mansfield_climati_cbc', redownload=flag_download)
+                       table='Mansfield_climati_cbc', redownload=_flag_download)
 
     # Organization df
     df = organize_df(df, sql_table)
@@ -115,10 +388,10 @@ def get_data_day(sel_dia="2023-01-01", sql_table="Mansfield_climati_cbc", flag_d
     return df, health_list, health_data, title
 
 
-@st.cache_data(experimental_allow_widgets=True, show_spinner=True)
+@st.cache_data(experimental_allow_widgets=True, show_spinner=True, ttl=24 * 3600, max_entries=50)
 # @st.experimental_memo(suppress_st_warning=True, show_spinner=True)
 def get_data_range(sel_dia_ini="2023-05-29", sel_dia_fin="2023-05-30", sql_table="Mansfield_climati_cbc",
-                   flag_download=False):
+                   _flag_download=False, version=0):
     """
     Programa que permite conectar con una base de dato del servidor y devuelve la base de dato como un pandas dataframe
     del periodo de fecha ingresado
@@ -126,7 +399,9 @@ def get_data_range(sel_dia_ini="2023-05-29", sel_dia_fin="2023-05-30", sql_table
         sel_dia_ini = Día inicial en STR ("2022-01-01")
         sel_dia_fin = Día final en STR ("2022-01-02")
         sql_table = Selección de la tabla SQL de climatización a la que se conectara
-        redownload = Debe descargarse la data o buscar dentro de los archivos previamente descargados
+        _flag_download = Debe descargarse la data o buscar dentro de los archivos previamente descargados.
+        No hace parte de la llave del cache.
+        version = Versión de los datos del periodo entregada por data_version, cambia cuando se refresca un día.
     OUTPUT:
         df = pandas dataframe traído de la base de dato SQL
         health_list = lista con el dato de salud por día
@@ -139,7 +414,7 @@ def get_data_range(sel_dia_ini="2023-05-29", sel_dia_fin="2023-05-30", sql_table
     # Connection BD SQL
     if sql_table in ['CBC 1-8', 'CBC 10-12']:
         df = find_load(tipo="rango_planta", ini=str(sel_dia_ini), day=str(sel_dia_fin),
-                       database="Mansfield_climati_cbc", table="Mansfield_climati_cbc", redownload=flag_download)
+                       database="Mansfield_climati_cbc", table="Mansfield_climati_cbc", redownload=_flag_download)
     # Organizing the raw DF
     df = organize_df(df, sql_table)
 
@@ -217,18 +492,33 @@ def organize_df(df, sql_table):
     return df
 
 
-def sql_connect(tipo="day", day="023-03-30", database='Mansfield_climati_cbc', table="Mansfield_climati_cbc"):
+def sql_engine(database='Mansfield_climati_cbc', pool_size=5, max_overflow=10):
     """
-    Programa que permite conectar con una base de dato del servidor y devuelve la base
-    de dato como un pandas dataframe
+    Función que crea el engine de SQLAlchemy de la base de datos. Se crea una sola vez por base de datos,
+    así todas las descargas comparten el mismo pool de conexiones
     INPUT:
-        tipo = ["day_planta", "day"]
-        day = Día a descargar en  STR ("2021-04-28")
         database: base de dato a la cual se debe conectar
-        table: tabla a la cual se debe conectar
+        pool_size: conexiones que el pool mantiene abiertas, solo se usa al crear el engine
+        max_overflow: conexiones extra que el pool puede abrir, solo se usa al crear el engine
     OUTPUT:
-        pd_sql = pandas dataframe traído de la base de dato SQL
+        conn = engine de SQLAlchemy
     """
+    with ENGINES_LOCK:
+        if database not in ENGINES:
+            ENGINES[database] = create_sql_engine(database, pool_size, max_overflow)
+
+    return ENGINES[database]
+
+
+def create_sql_engine(database, pool_size, max_overflow):
+    """
+    Función que crea un engine nuevo de SQLAlchemy, se usa a través de sql_engine
+    """
+    # The SQL driver is only loaded when a day has to be downloaded
+    from dotenv import load_dotenv
+    from sqlalchemy import create_engine
+    from sqlalchemy.engine import URL
+
     # Connection keys
     load_dotenv('./.env')
 
@@ -240,7 +530,41 @@ def sql_connect(tipo="day", day="023-03-30", database='Mansfield_climati_cbc', t
     connection_str = f'DRIVER={{SQL SERVER}};SERVER={server};DATABASE={database}; UID={username};PWD={password}'
     connection_url = URL.create("mssql+pyodbc", query={"odbc_connect": connection_str})
 
-    conn = create_engine(connection_url)
+    conn = create_engine(connection_url, pool_size=pool_size, max_overflow=max_overflow)
+
+    return conn
+
+
+def sql_count(day="2023-03-30", database='Mansfield_climati_cbc', table="Mansfield_climati_cbc"):
+    """
+    Función que cuenta en el servidor SQL las filas de un día, se usa para verificar los archivos descargados
+    INPUT:
+        day = Día a contar en STR ("2021-04-28")
+        database: base de dato a la cual se debe conectar
+        table: tabla a la cual se debe conectar
+    OUTPUT:
+        count = Número de filas del día en la base de dato SQL
+    """
+    conn = sql_engine(database)
+    pd_sql = pd.read_sql_query("SELECT COUNT(*) AS filas FROM " + database + ".dbo." + table + " WHERE fecha like '"
+                               + day + "'", conn)
+
+    return int(pd_sql['filas'].iloc[0])
+
+
+def sql_connect(tipo="day", day="023-03-30", database='Mansfield_climati_cbc', table="Mansfield_climati_cbc"):
+    """
+    Programa que permite conectar con una base de dato del servidor y devuelve la base
+    de dato como un pandas dataframe
+    INPUT:
+        tipo = ["day_planta", "day"]
+        day = Día a descargar en  STR ("2021-04-28")
+        database: base de dato a la cual se debe conectar
+        table: tabla a la cual se debe conectar
+    OUTPUT:
+        pd_sql = pandas dataframe traído de la base de dato SQL
+    """
+    conn = sql_engine(database)
     # -----------------------------------------------------------------------------------------------
     # Tipos de conexiones establecidas para traer distintas cantidades de datos
     # -----------------------------------------------------------------------------------------------
@@ -254,9 +578,18 @@ def sql_connect(tipo="day", day="023-03-30", database='Mansfield_climati_cbc', t
             # Checking and creating the folder
             folder = day[:-3]
             if not os.path.exists('./Data/Raw/' + folder):
-                os.makedirs('./Data/Raw/' + folder)
-            # Saving the raw data
-            pd_sql.to_csv('./Data/Raw/' + folder + '/' + table + '_' + day + '.csv', index=False)
+                os.makedirs('./Data/Raw/' + folder, exist_ok=True)
+            # Saving the raw data, renaming a temporal file of this writer so an interrupted or simultaneous
+            # download never leaves half a day
+            filename = './Data/Raw/' + folder + '/' + table + '_' + day + '.csv'
+            handle, temporal = tempfile.mkstemp(dir='./Data/Raw/' + folder, suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'w', newline='') as file:
+                    pd_sql.to_csv(file, index=False)
+                os.replace(temporal, filename)
+            finally:
+                if os.path.exists(temporal):
+                    os.remove(temporal)
 
     return pd_sql
 
@@ -277,6 +610,7 @@ def add_day(day, add=1):
     return str(ini_date), str(fin_date)
 
 
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=10)
 def to_excel(df):
     """
     Función para agregar los datos a un excel y poder descargarlo
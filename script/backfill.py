@@ -0,0 +1,157 @@
+# Bulk historical backfill of the day cache ./Data/Raw
+# Run from the root of the repository, where the .env file is:
+#   python script/backfill.py 2022-01-01 2023-05-31 --table Mansfield_climati_cbc --workers 4
+# The verified days are saved in a checkpoint file, running the same command again resumes the backfill.
+# ----------------------------------------------------------------------------------------------------------------------
+# Library
+# ----------------------------------------------------------------------------------------------------------------------
+import argparse
+import datetime
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Sql_Function import (compact_month, drop_month, find_load, is_compacted, month_cached, month_complete,
+                          sql_count, sql_engine)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Function definition
+# ----------------------------------------------------------------------------------------------------------------------
+def load_checkpoint(filename):
+    """
+    Carga el checkpoint: {"done": {"2023-05-01": filas}, "failed": {"2023-05-02": [filas archivo, filas SQL]}}
+    """
+    if os.path.exists(filename):
+        with open(filename) as file:
+            return json.load(file)
+
+    return {'done': {}, 'failed': {}}
+
+
+def save_checkpoint(filename, checkpoint):
+    """
+    Guarda el checkpoint renombrando un archivo temporal, así una interrupción no deja el archivo dañado
+    """
+    with open(filename + '.tmp', 'w') as file:
+        json.dump(checkpoint, file, indent=1, sort_keys=True)
+    os.replace(filename + '.tmp', filename)
+
+
+def backfill_chunk(days, database, table, redownload):
+    """
+    Descarga (o lee del cache) los días de un bloque y compara sus filas con el COUNT(*) del servidor SQL.
+    Si un día del cache no coincide se descarga nuevamente una vez.
+    INPUT:
+        days: lista de días en STR ("2023-05-01")
+        database: base de dato a la cual se debe conectar
+        table: tabla a la cual se debe conectar
+        redownload = TRUE or FALSE statement si es TRUE se descargan todos los días aunque ya existan
+    OUTPUT:
+        result: {día: (filas archivo, filas SQL)}
+    """
+    result = {}
+    for day in days:
+        count = sql_count(day, database, table)
+        rows = find_load(tipo='day', day=day, ini=None, database=database, table=table,
+                         redownload=redownload).shape[0]
+        if rows != count and redownload is False:
+            rows = find_load(tipo='day', day=day, ini=None, database=database, table=table,
+                             redownload=True).shape[0]
+        result[day] = (rows, count)
+
+    return result
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Main
+# ----------------------------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backfill and verification of the day cache ./Data/Raw')
+    parser.add_argument('ini', type=datetime.date.fromisoformat, help='Starting day (2022-01-01)')
+    parser.add_argument('end', type=datetime.date.fromisoformat, help='End day (2023-05-31)')
+    parser.add_argument('--database', default='Mansfield_climati_cbc')
+    parser.add_argument('--table', default='Mansfield_climati_cbc')
+    parser.add_argument('--workers', type=int, default=4, help='Chunks downloaded at the same time')
+    parser.add_argument('--chunk', type=int, default=7, help='Days in every chunk')
+    parser.add_argument('--checkpoint', default=None, help='Default ./Data/backfill_<table>.json')
+    parser.add_argument('--redownload', action='store_true', help='Download again the days already in the cache')
+    parser.add_argument('--compact', action='store_true', help='Compact the finished months after the backfill')
+    args = parser.parse_args()
+
+    # The paths of Sql_Function are relative to the root of the repository
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    checkpoint_file = args.checkpoint or './Data/backfill_' + args.table + '.json'
+    os.makedirs(os.path.dirname(checkpoint_file) or '.', exist_ok=True)
+
+    # The current day is never saved in the cache, the backfill stops yesterday
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    if args.end > yesterday:
+        print(f'The end day is moved to {yesterday}, the current day is not saved in the cache')
+        args.end = yesterday
+
+    checkpoint = load_checkpoint(checkpoint_file)
+    if args.redownload:
+        # Only the days of the requested period are verified again, the rest of the checkpoint is kept
+        for key in ['done', 'failed']:
+            checkpoint[key] = {d: v for d, v in checkpoint[key].items() if not str(args.ini) <= d <= str(args.end)}
+
+    # Pending days, split in chunks
+    days = []
+    day = args.ini
+    while day <= args.end:
+        if str(day) not in checkpoint['done']:
+            days.append(str(day))
+        # Avant a day
+        day = day + datetime.timedelta(days=1)
+    chunks = [days[i:i + args.chunk] for i in range(0, len(days), args.chunk)]
+    print(f'{len(days)} days pending in {len(chunks)} chunks, {len(checkpoint["done"])} days already verified')
+
+    # The compacted months of the period are dropped here once, not by every worker downloading one of their days
+    if args.redownload:
+        for month in sorted({d[:-3] for d in days}):
+            drop_month(month, args.table)
+
+    # Parallel download, all the workers share the connection pool of sql_engine. The engine is created here,
+    # before the workers start, with one connection per worker and the same number of extra connections
+    sql_engine(args.database, pool_size=args.workers, max_overflow=args.workers)
+    errors = []
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(backfill_chunk, chunk, args.database, args.table, args.redownload): chunk
+                   for chunk in chunks}
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                result = future.result()
+            except Exception as error:
+                print(f'{chunk[0]} - {chunk[-1]}: error {error}')
+                errors.append(chunk)
+                continue
+
+            for day, (rows, count) in result.items():
+                if rows == count:
+                    checkpoint['done'][day] = rows
+                    checkpoint['failed'].pop(day, None)
+                else:
+                    checkpoint['failed'][day] = [rows, count]
+            save_checkpoint(checkpoint_file, checkpoint)
+            print(f'{chunk[0]} - {chunk[-1]}: {sum(r for r, c in result.values())} rows, '
+                  f'{sum(r != c for r, c in result.values())} days with different count')
+
+    # Compacting the finished months already complete in the cache
+    if args.compact:
+        months = sorted({d[:-3] for d in checkpoint['done'] if str(args.ini) <= d <= str(args.end)})
+        for month in months:
+            if month_complete(month) and month_cached(month, args.table) and not is_compacted(month, args.table):
+                compact_month(month, args.database, args.table)
+                print(f'{month}: compacted')
+
+    failed = sorted(d for d in checkpoint['failed'] if str(args.ini) <= d <= str(args.end))
+    if failed:
+        print(f'{len(failed)} days with a different count than SQL: {", ".join(failed)}')
+    if errors:
+        print(f'{len(errors)} chunks with errors: {", ".join(c[0] + " - " + c[-1] for c in errors)}')
+    sys.exit(1 if failed or errors else 0)
@@ -0,0 +1,74 @@
+# Round trip check of the compacted month store
+# Builds a synthetic finished month in a temporal folder (with one empty day, as the ones saved by an outage),
+# compacts it and compares load_month against load_days. Run from the root of the repository:
+#   python script/check_compact.py
+# ----------------------------------------------------------------------------------------------------------------------
+# Library
+# ----------------------------------------------------------------------------------------------------------------------
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Sql_Function import DAMPER_COLUMNS, compact_month, load_days, load_month, month_folder, organize_df
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Variables definition
+# ----------------------------------------------------------------------------------------------------------------------
+month = '2023-02'
+table = 'Mansfield_climati_cbc'
+empty_day = '2023-02-10'
+sensors = ['Z1_T', 'Z2_T', 'Z3_T', 'Z1_HR', 'Z2_HR', 'Z3_HR', 'HA1_T_Iny', 'HA1_T_Rec', 'HA1_T_Fac', 'HA1_T_AHA',
+           'HA1_T_OUT', 'HA2_T_Iny', 'HA2_T_Rec', 'HA2_T_Fac', 'HA2_T_AHA', 'HA2_T_OUT', 'HA1_2_OUT_HR']
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Main
+# ----------------------------------------------------------------------------------------------------------------------
+root = tempfile.mkdtemp()
+os.chdir(root)
+os.makedirs('./Data/Raw/' + month)
+rng = np.random.default_rng(0)
+
+# One day every 30 seconds, the dampers change a few times a day
+for day in pd.date_range(month + '-01', month + '-28').strftime('%Y-%m-%d'):
+    n = 24 * 60 * 2
+    df = pd.DataFrame({'fecha': day, 'hora': np.arange(n) // 120, 'minuto': (np.arange(n) // 2) % 60,
+                       'segundo': (np.arange(n) % 2) * 30})
+    for column in sensors:
+        df[column] = np.round(rng.normal(70, 5, n), 2)
+    for column in DAMPER_COLUMNS:
+        df[column] = np.repeat(rng.choice([0.0, 50.0, 100.0], 8), n // 8)
+    if day == empty_day:
+        df = df.iloc[:0]
+    df.to_csv('./Data/Raw/' + month + '/' + table + '_' + day + '.csv', index=False)
+
+compact_month(month, table, table)
+
+fail = False
+for ini, end in [('2023-02-01', '2023-02-28'), ('2023-02-09', '2023-02-11'), (empty_day, empty_day)]:
+    expected = organize_df(load_days(pd.Timestamp(ini).date(), pd.Timestamp(end).date(), table, table, False),
+                           'CBC 1-8')
+    result = organize_df(load_month(month, table, ini, end), 'CBC 1-8')
+    try:
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+        print(f'{ini} - {end}: {len(result)} rows OK')
+    except AssertionError as error:
+        print(f'{ini} - {end}: FAIL\n{error}')
+        fail = True
+
+# The compacted month has to be smaller than the csv files it replaces
+size_csv = sum(os.path.getsize('./Data/Raw/' + month + '/' + f) for f in os.listdir('./Data/Raw/' + month))
+folder = month_folder(month, table)
+size_compact = sum(os.path.getsize(folder + f) for f in os.listdir(folder))
+status = 'OK' if size_compact < size_csv else 'FAIL'
+fail = fail or status == 'FAIL'
+print(f'csv {size_csv / 1e6:.1f} MB, compacted {size_compact / 1e6:.1f} MB {status}')
+
+os.chdir('/')
+shutil.rmtree(root, ignore_errors=True)
+sys.exit(1 if fail else 0)
@@ -0,0 +1,81 @@
+# Import time budget of the app modules
+# ----------------------------------------------------------------------------------------------------------------------
+# Library
+# ----------------------------------------------------------------------------------------------------------------------
+import ast
+import os
+import subprocess
+import sys
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Variables definition
+# ----------------------------------------------------------------------------------------------------------------------
+# Run from the root of the repository: python script/import_budget.py
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that the entry point can't import at module level, they are imported when the user asks for the graph
+entry_point = 'IIOT_Mansfield.py'
+entry_forbidden = ['Plotly_Function', 'Sql_Function', 'sqlalchemy', 'plotly', 'pyodbc', 'xlsxwriter']
+
+# Maximum seconds of a cold import (each one is measured in a new python process). The app modules are measured
+# after streamlit is loaded, so only their own cost is counted (~0.003 s Sql_Function, ~0.01 s Plotly_Function
+# measured). streamlit is a third party import the app can't change, its time (~0.85 s) is only reported
+budget = {'streamlit': None,
+          'Sql_Function': 0.05,
+          'Plotly_Function': 0.1}
+
+# Modules that must not be loaded by a cold import, they are loaded only when they are needed.
+# streamlit itself already loads pandas and plotly.graph_objects
+lazy = {'Sql_Function': ['sqlalchemy', 'pyodbc', 'xlsxwriter', 'plotly.subplots'],
+        'Plotly_Function': ['sqlalchemy', 'pyodbc', 'xlsxwriter']}
+
+code = """
+import sys, time
+{preload}
+t = time.perf_counter()
+import {module}
+print(time.perf_counter() - t)
+print(','.join(m for m in {lazy} if m in sys.modules))
+"""
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Main
+# ----------------------------------------------------------------------------------------------------------------------
+fail = False
+
+# Module level imports of the entry point
+with open(os.path.join(root, entry_point), encoding='utf-8') as file:
+    tree = ast.parse(file.read())
+for node in tree.body:
+    if isinstance(node, ast.Import):
+        names = [alias.name for alias in node.names]
+    elif isinstance(node, ast.ImportFrom):
+        names = [node.module or '']
+    else:
+        continue
+    for name in names:
+        if name.split('.')[0] in entry_forbidden:
+            print(f'{entry_point}:{node.lineno}: module level import of {name} FAIL')
+            fail = True
+
+# Import time of every module
+for module, limit in budget.items():
+    preload = '' if module == 'streamlit' else 'import streamlit'
+    result = subprocess.run([sys.executable, '-c', code.format(preload=preload, module=module,
+                                                               lazy=lazy.get(module, []))],
+                            cwd=root, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f'{module}: import error\n{result.stderr}')
+        fail = True
+        continue
+
+    seconds, loaded = result.stdout.split('\n')[:2]
+    seconds = float(seconds)
+    if limit is None:
+        print(f'{module}: {seconds:.3f} s (no budget, reported only)')
+        continue
+    status = 'OK' if seconds <= limit and not loaded else 'FAIL'
+    fail = fail or status == 'FAIL'
+    print(f'{module}: {seconds:.3f} s (budget {limit:.3f} s) {status}' + (f' | loaded: {loaded}' if loaded else ''))
+
+sys.exit(1 if fail else 0)